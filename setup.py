@@ -35,9 +35,12 @@ setup(
     install_requires=[
         "zepben.evolve==0.23.0b27",
         "dataclassy==0.6.2",
-        "bitstring==3.1.7"
+        "bitstring==3.1.7",
+        "numpy==2.4.6"
     ],
     extras_require={
         "test": test_deps,
+        "arrow": ["pyarrow==25.0.1"],
+        "jit": ["numba==0.67.0"],
     }
 )
@@ -11,10 +11,11 @@ from __future__ import annotations
 from datetime import date
 from typing import Callable, Set, Dict, List, Generator
 
+import numpy as np
 from bitstring import BitStream
 from dataclassy import dataclass
 
-from load_synthesiser.db.readings import Readings, encode_7bit_long, OneChannelReadings
+from load_synthesiser.db.readings import Readings, encode_7bit_long, OneChannelReadings, ArrayReadings
 
 
 @dataclass
@@ -60,6 +61,18 @@ class EnergyProfile(object):
         self._kw_in.channel(1).append(in_val)
         self._kw_out.channel(1).append(out_val)
 
+    def add_readings_bulk(self, kw_in: np.ndarray, kw_out: np.ndarray):
+        """
+        Replace the readings of this profile with a full day of values in one call, avoiding a python-level append per reading. The two channels
+        are kept as separate contiguous arrays so each can be scanned or serialised without striding over the other.
+        :param kw_in: The kw into this ID for each interval of the day.
+        :param kw_out: The kw out of this ID for each interval of the day. Must be the same length as `kw_in`.
+        """
+        if len(kw_in) != len(kw_out):
+            raise ValueError("Readings must have the same length")
+        self._kw_in = ArrayReadings(np.ascontiguousarray(kw_in, dtype=np.float64))
+        self._kw_out = ArrayReadings(np.ascontiguousarray(kw_out, dtype=np.float64))
+
     @property
     def kw_in(self) -> Readings:
         return self._kw_in
@@ -7,7 +7,7 @@
 import sqlite3
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Generator, List, Iterable, Set
+from typing import Generator, List, Iterable, Set, Optional, Tuple
 
 from datetime import date, datetime
 from dataclassy import dataclass
@@ -32,7 +32,6 @@ SCHEMA = [
 def write_database(destdir: str, dt: date):
     db = SqliteReadingsDatabase(f"{destdir}/{dt.isoformat()}/{dt.isoformat()}-load-readings.sqlite", dt)
     Path(f"{destdir}/{dt.isoformat()}").mkdir(parents=True, exist_ok=True)
-    db.initialise()
     return db
 
 
@@ -40,12 +39,42 @@ def write_database(destdir: str, dt: date):
 class SqliteDatabase(object):
     path: str
 
+    _conn: Optional[sqlite3.Connection] = None
     _entity_ids_written: bool = False
 
-    @contextmanager
-    def connection(self) -> sqlite3.Connection:
+    def open_connection(self) -> sqlite3.Connection:
         conn = sqlite3.connect(self.path)
         conn.isolation_level = None  # autocommit off
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode = MEMORY")
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.close()
+        return conn
+
+    def __enter__(self):
+        """
+        Hold a single connection open and wrap every write until `__exit__` in one explicit transaction. Without this each statement implicitly
+        commits, paying a journal write per insert rather than one per database.
+        """
+        self._conn = self.open_connection()
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    @contextmanager
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is not None:
+            yield self._conn
+            return
+
+        conn = self.open_connection()
         yield conn
         conn.commit()
         conn.close()
@@ -54,8 +83,6 @@ class SqliteDatabase(object):
     def cursor(self) -> Generator[sqlite3.Cursor, None, None]:
         with self.connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("PRAGMA journal_mode = OFF")
-            cursor.execute("PRAGMA synchronous = OFF")
             yield cursor
             cursor.close()
 
@@ -64,12 +91,15 @@ class SqliteDatabase(object):
             return
 
         with self.cursor() as c:
-            for id in entity_ids:
-                c.execute(f"INSERT INTO entity_ids VALUES (NULL, '{id}')")
+            c.executemany("INSERT INTO entity_ids VALUES (NULL, ?)", ((id,) for id in entity_ids))
         self._entity_ids_written = True
 
 
 class SqliteReadingsDatabase(SqliteDatabase):
+    """
+    A readings database for a single day. Must be used as a context manager: all writes are staged in an in-memory database so ingest never
+    touches a journal or the disk, and the finished database is flushed to `path` as one large sequential write when the context exits.
+    """
     SELECT_ID_FROM_INDEX = "(SELECT id FROM entity_ids where entity_id = ?)"
     SQL_INSERT_W_IN_FORMAT = f"INSERT INTO W_in (id, data) VALUES ({SELECT_ID_FROM_INDEX}, ?)"
     SQL_INSERT_W_OUT_FORMAT = f"INSERT INTO W_out (id, data) VALUES ({SELECT_ID_FROM_INDEX}, ?)"
@@ -79,6 +109,29 @@ class SqliteReadingsDatabase(SqliteDatabase):
     dt: date
     _entity_ids: Set[str] = set()
 
+    def open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(":memory:")
+        conn.isolation_level = None  # autocommit off
+        return conn
+
+    def __enter__(self):
+        super().__enter__()
+        self.initialise()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self._conn.execute("COMMIT")
+                dest = sqlite3.connect(self.path)
+                self._conn.backup(dest)
+                dest.close()
+            else:
+                self._conn.execute("ROLLBACK")
+        finally:
+            self._conn.close()
+            self._conn = None
+
     def initialise(self):
         self.create_schema()
 
@@ -101,26 +154,30 @@ class SqliteReadingsDatabase(SqliteDatabase):
             c.execute(f"INSERT INTO schema_version VALUES (1)")
 
     def write_readings(self, energy_profiles: Iterable[EnergyProfile]):
+        w_in = []
+        w_out = []
+        maximums = []
+        cacheables = []
+        for profile in energy_profiles:
+            if profile.id in self._entity_ids:  # id may be in multiple feeders, in which case it only gets stored in the DB once
+                continue
+            self._entity_ids.add(profile.id)
+            w_in.append((profile.id, readings_sx(profile.kw_in).read("bytes")))
+            w_out.append((profile.id, readings_sx(profile.kw_out).read("bytes")))
+            maximums.append((profile.id, self.serialise_maximum(profile)))
+            cacheables.append((profile.id, cacheable_sx(True)))
+
+        # One prepared statement per table via executemany rather than four execute calls per profile.
         with self.cursor() as c:
-            for profile in energy_profiles:
-                if profile.id in self._entity_ids:  # id may be in multiple feeders, in which case it only gets stored in the DB once
-                    continue
-                self._entity_ids.add(profile.id)
-                serialised_readings_in = readings_sx(profile.kw_in).read("bytes")
-                serialised_readings_out = readings_sx(profile.kw_out).read("bytes")
-                c.execute(self.SQL_INSERT_W_IN_FORMAT, (profile.id, serialised_readings_in))
-                c.execute(self.SQL_INSERT_W_OUT_FORMAT, (profile.id, serialised_readings_out))
-                self.write_maximum(c, profile)
-                self.write_cacheable(c, profile.id, True)
-
-    def write_maximum(self, cursor, energy_profile: EnergyProfile):
-        eps = accumulating(energy_profile, max, lambda l, v: v, 0, 0, -999999999999.9999)
-        serialised_eps = eps_sx(eps).read("bytes")
-        cursor.execute(self.SQL_INSERT_MAXIMUMS, (energy_profile.id, serialised_eps))
+            c.executemany(self.SQL_INSERT_W_IN_FORMAT, w_in)
+            c.executemany(self.SQL_INSERT_W_OUT_FORMAT, w_out)
+            c.executemany(self.SQL_INSERT_MAXIMUMS, maximums)
+            c.executemany(self.SQL_INSERT_CACHEABLE, cacheables)
 
-    def write_cacheable(self, cursor, id: str, cacheable: bool):
-        serialised = cacheable_sx(cacheable)
-        cursor.execute(self.SQL_INSERT_CACHEABLE, (id, serialised))
+    @staticmethod
+    def serialise_maximum(energy_profile: EnergyProfile) -> bytes:
+        eps = accumulating(energy_profile, max, lambda l, v: v, 0, 0, -999999999999.9999)
+        return eps_sx(eps).read("bytes")
 
 
 class IndexSqliteDatabase(SqliteDatabase):
@@ -141,6 +198,9 @@ class IndexSqliteDatabase(SqliteDatabase):
             cursor.execute("INSERT INTO schema_version VALUES (1)")
 
     def write_index(self, id: str, date_range: IdDateRange):
+        self.write_indexes([(id, date_range)])
+
+    def write_indexes(self, date_ranges: Iterable[Tuple[str, IdDateRange]]):
+        # One prepared statement via executemany rather than a cursor (and thus connection + commit) per id.
         with self.cursor() as c:
-            serialised_date_range = date_range.sx().read("bytes")
-            c.execute(self.SQL_INSERT_DATE_RANGE, (id, serialised_date_range))
+            c.executemany(self.SQL_INSERT_DATE_RANGE, ((id, date_range.sx().read("bytes")) for id, date_range in date_ranges))
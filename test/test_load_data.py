@@ -0,0 +1,62 @@
+#  Copyright 2021 Zeppelin Bend Pty Ltd
+#
+#  This Source Code Form is subject to the terms of the Mozilla Public
+#  License, v. 2.0. If a copy of the MPL was not distributed with this
+#  file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import sqlite3
+
+import pytest
+
+pytest.importorskip("zepben.evolve")
+
+from load_synthesiser.main import load_data
+
+POWER_RATINGS = {"f1": {"t1": 0.25, "t2": 0.75}, "f2": {"t3": 1.0}}
+DAYS = ["2021-01-01", "2021-01-02"]
+
+
+@pytest.fixture
+def load_csv(tmp_path, monkeypatch):
+    """
+    A small two-feeder, two-day load csv, with the network fetch stubbed out so load_data runs end to end without a gRPC service.
+    """
+    monkeypatch.setattr("load_synthesiser.main.fetch_power_ratings", lambda channel, feeder_mrids: POWER_RATINGS)
+    path = tmp_path / "pq.csv"
+    rows = ["feeder,date,time,kw"]
+    for feeder in POWER_RATINGS:
+        for day in DAYS:
+            for time in ["00:00:00Z", "00:30:00Z"]:
+                rows.append(f"{feeder},{day},{time},2.0")
+    path.write_text("\n".join(rows))
+    return path
+
+
+def test_load_data_writes_day_databases_and_index(load_csv, tmp_path):
+    out_dir = tmp_path / "data"
+
+    load_data(str(load_csv), None, set(POWER_RATINGS), str(out_dir), False)
+
+    for day in DAYS:
+        conn = sqlite3.connect(out_dir / day / f"{day}-load-readings.sqlite")
+        assert conn.execute("SELECT count(*) FROM W_in").fetchone()[0] == 3
+        assert conn.execute("SELECT count(*) FROM entity_ids").fetchone()[0] == 3
+        assert conn.execute("SELECT value FROM metadata WHERE key = 'date'").fetchone()[0] == day
+        conn.close()
+
+    index = sqlite3.connect(out_dir / "load-readings-index.sqlite")
+    assert index.execute("SELECT count(*) FROM entity_ids").fetchone()[0] == 3
+    assert index.execute("SELECT count(*) FROM dateRange").fetchone()[0] == 3
+    index.close()
+
+
+def test_load_data_writes_parquet_days(load_csv, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    out_dir = tmp_path / "data"
+
+    load_data(str(load_csv), None, set(POWER_RATINGS), str(out_dir), False, output_format="parquet")
+
+    for day in DAYS:
+        table = pq.read_table(out_dir / f"{day}-load-readings.parquet")
+        assert table.num_rows == 6  # 3 transformers x 2 intervals
+        assert set(table.column("entity_id").to_pylist()) == {"t1", "t2", "t3"}
+    assert not (out_dir / "load-readings-index.sqlite").exists()